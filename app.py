@@ -6,7 +6,7 @@ Routes are organized in separate blueprint modules in the routes package.
 """
 
 from flask import Flask
-from database import init_database, add_sample_data
+from database import init_database, add_sample_data, init_app
 from routes import register_blueprints
 
 
@@ -26,6 +26,9 @@ def create_app():
     # Add sample data for testing and demonstration
     add_sample_data()
     
+    # Share one database connection per request
+    init_app(app)
+    
     # Register all route blueprints
     register_blueprints(app)
     
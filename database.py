@@ -7,19 +7,51 @@ import sqlite3
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
+from flask import g, has_app_context
+
 # Database configuration
 DATABASE = 'library.db'
 
 def get_db_connection():
-    """Get a database connection."""
+    """Get a database connection, shared for the rest of the request inside an app context."""
+    if has_app_context() and 'db' in g:
+        return g.db
     conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    # Per-connection tuning; safe with WAL, which init_database enables
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA mmap_size = 268435456')
+    # Unicode-aware lowercasing; SQLite's own LOWER/LIKE only fold ASCII
+    conn.create_function('py_lower', 1, str.lower, deterministic=True)
+    if has_app_context():
+        g.db = conn
     return conn
 
+def release_db_connection(conn):
+    """Close a connection unless it is the one bound to the current request."""
+    if has_app_context() and g.get('db') is conn:
+        return
+    conn.close()
+
+def close_db(e=None):
+    """Close the request-bound connection, if any, when the app context ends."""
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+def init_app(app):
+    """Register database teardown with the Flask app."""
+    app.teardown_appcontext(close_db)
+
 def init_database():
     """Initialize the database with required tables."""
     conn = get_db_connection()
     
+    # Write-ahead logging lets readers and the writer run concurrently and
+    # persists in the database file once set
+    conn.execute('PRAGMA journal_mode = WAL')
+    
     # Create books table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS books (
@@ -44,9 +76,18 @@ def init_database():
             FOREIGN KEY (book_id) REFERENCES books (id)
         )
     ''')
-    
+
+    # Indexes for catalog search and per-patron borrow lookups
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_title ON books (title COLLATE NOCASE)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_author ON books (author COLLATE NOCASE)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_br_patron ON borrow_records (patron_id, return_date)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_br_patron_book
+        ON borrow_records (patron_id, book_id, return_date)
+    ''')
+
     conn.commit()
-    conn.close()
+    release_db_connection(conn)
 
 def add_sample_data():
     """Add sample data to the database if it's empty."""
@@ -80,7 +121,7 @@ def add_sample_data():
         
         conn.commit()
     
-    conn.close()
+    release_db_connection(conn)
 
 # Helper Functions for Database Operations
 
@@ -88,23 +129,60 @@ def get_all_books() -> List[Dict]:
     """Get all books from the database."""
     conn = get_db_connection()
     books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
+    release_db_connection(conn)
     return [dict(book) for book in books]
 
 def get_book_by_id(book_id: int) -> Optional[Dict]:
     """Get a specific book by ID."""
     conn = get_db_connection()
     book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
+    release_db_connection(conn)
     return dict(book) if book else None
 
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
     """Get a specific book by ISBN."""
     conn = get_db_connection()
     book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
+    release_db_connection(conn)
     return dict(book) if book else None
 
+def search_books_by_field(field: str, term: str, limit: int = 100) -> List[Dict]:
+    """Get up to `limit` books whose title or author contains the term (case-insensitive)."""
+    if field not in ('title', 'author'):
+        return []
+    conn = get_db_connection()
+    if term.isascii():
+        # LIKE ignores ASCII case natively; escape wildcards so the term is literal
+        pattern = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        books = conn.execute(f'''
+            SELECT * FROM books
+            WHERE {field} LIKE ? ESCAPE '\\'
+            ORDER BY title
+            LIMIT ?
+        ''', (f'%{pattern}%', limit)).fetchall()
+    else:
+        # LIKE does not fold non-ASCII case, so lowercase both sides in Python
+        books = conn.execute(f'''
+            SELECT * FROM books
+            WHERE instr(py_lower({field}), ?) > 0
+            ORDER BY title
+            LIMIT ?
+        ''', (term.lower(), limit)).fetchall()
+    release_db_connection(conn)
+    return [dict(book) for book in books]
+
+def _loan_from_row(record, now: datetime) -> Dict:
+    """Convert a borrow record row joined with its book into a loan dict."""
+    due_date = datetime.fromisoformat(record['due_date'])
+    return {
+        'book_id': record['book_id'],
+        'title': record['title'],
+        'author': record['author'],
+        'borrow_date': datetime.fromisoformat(record['borrow_date']),
+        'due_date': due_date,
+        'is_overdue': now > due_date
+    }
+
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     """Get currently borrowed books for a patron."""
     conn = get_db_connection()
@@ -115,20 +193,60 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
         WHERE br.patron_id = ? AND br.return_date IS NULL
         ORDER BY br.borrow_date
     ''', (patron_id,)).fetchall()
-    conn.close()
+    release_db_connection(conn)
+    
+    now = datetime.now()
+    return [_loan_from_row(record, now) for record in records]
+
+def get_active_borrow_record(patron_id: str, book_id: int) -> Optional[Dict]:
+    """Get the active (not yet returned) borrow record for a patron and book."""
+    conn = get_db_connection()
+    record = conn.execute('''
+        SELECT br.*, b.title, b.author 
+        FROM borrow_records br 
+        JOIN books b ON br.book_id = b.id 
+        WHERE br.patron_id = ? AND br.book_id = ? AND br.return_date IS NULL
+        ORDER BY br.borrow_date
+        LIMIT 1
+    ''', (patron_id, book_id)).fetchone()
+    release_db_connection(conn)
     
-    borrowed_books = []
-    for record in records:
-        borrowed_books.append({
-            'book_id': record['book_id'],
-            'title': record['title'],
-            'author': record['author'],
-            'borrow_date': datetime.fromisoformat(record['borrow_date']),
-            'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
-        })
+    if not record:
+        return None
     
-    return borrowed_books
+    return _loan_from_row(record, datetime.now())
+
+def get_patron_loans_and_history(patron_id: str) -> List[Dict]:
+    """Get every borrow record for a patron, newest first, flagged as active or returned."""
+    conn = get_db_connection()
+    records = conn.execute('''
+        SELECT br.*, b.title, b.author, (br.return_date IS NULL) AS active
+        FROM borrow_records br 
+        JOIN books b ON br.book_id = b.id 
+        WHERE br.patron_id = ?
+        ORDER BY br.borrow_date DESC
+    ''', (patron_id,)).fetchall()
+    release_db_connection(conn)
+    return [dict(record) for record in records]
+
+def get_patron_total_late_fees(patron_id: str, as_of: Optional[datetime] = None) -> float:
+    """Get the summed late fees for a patron's overdue loans, computed in SQL."""
+    as_of = as_of or datetime.now()
+    conn = get_db_connection()
+    total = conn.execute('''
+        SELECT COALESCE(SUM(MIN(15.0, CASE
+            WHEN days <= 7 THEN days * 0.5
+            ELSE 3.5 + (days - 7) * 1.0
+        END)), 0) AS total
+        FROM (
+            SELECT CAST(JULIANDAY(?) - JULIANDAY(due_date) AS INTEGER) AS days
+            FROM borrow_records
+            WHERE patron_id = ? AND return_date IS NULL
+        )
+        WHERE days > 0
+    ''', (as_of.isoformat(), patron_id)).fetchone()['total']
+    release_db_connection(conn)
+    return float(total)
 
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
@@ -137,7 +255,7 @@ def get_patron_borrow_count(patron_id: str) -> int:
         SELECT COUNT(*) as count FROM borrow_records 
         WHERE patron_id = ? AND return_date IS NULL
     ''', (patron_id,)).fetchone()['count']
-    conn.close()
+    release_db_connection(conn)
     return count
 
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
@@ -149,10 +267,11 @@ def insert_book(title: str, author: str, isbn: str, total_copies: int, available
             VALUES (?, ?, ?, ?, ?)
         ''', (title, author, isbn, total_copies, available_copies))
         conn.commit()
-        conn.close()
+        release_db_connection(conn)
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
+        release_db_connection(conn)
         return False
 
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
@@ -164,12 +283,53 @@ def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, du
             VALUES (?, ?, ?, ?)
         ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
         conn.commit()
-        conn.close()
+        release_db_connection(conn)
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
+        release_db_connection(conn)
         return False
 
+def try_borrow_book(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                    max_borrowed: int = 5) -> str:
+    """
+    Atomically take a copy of a book and record the loan.
+    
+    Returns 'ok' on success, otherwise 'unavailable', 'limit_reached' or 'error'.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute('''
+            UPDATE books SET available_copies = available_copies - 1
+            WHERE id = ? AND available_copies > 0
+              AND (SELECT COUNT(*) FROM borrow_records
+                   WHERE patron_id = ? AND return_date IS NULL) < ?
+        ''', (book_id, patron_id, max_borrowed))
+        
+        if cursor.rowcount == 0:
+            # Work out which condition failed, availability first
+            available = conn.execute(
+                'SELECT available_copies FROM books WHERE id = ?', (book_id,)
+            ).fetchone()
+            conn.rollback()
+            release_db_connection(conn)
+            if not available or available['available_copies'] <= 0:
+                return 'unavailable'
+            return 'limit_reached'
+        
+        conn.execute('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+        conn.commit()
+        release_db_connection(conn)
+        return 'ok'
+    except Exception as e:
+        conn.rollback()
+        release_db_connection(conn)
+        return 'error'
+
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
     conn = get_db_connection()
@@ -178,10 +338,11 @@ def update_book_availability(book_id: int, change: int) -> bool:
             UPDATE books SET available_copies = available_copies + ? WHERE id = ?
         ''', (change, book_id))
         conn.commit()
-        conn.close()
+        release_db_connection(conn)
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
+        release_db_connection(conn)
         return False
 
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
@@ -194,8 +355,9 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
             WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
         ''', (return_date.isoformat(), patron_id, book_id))
         conn.commit()
-        conn.close()
+        release_db_connection(conn)
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
+        release_db_connection(conn)
         return False
@@ -3,14 +3,36 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
+import re
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from database import (
-    get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books
+    get_book_by_id, get_book_by_isbn, try_borrow_book,
+    insert_book, update_book_availability,
+    update_borrow_record_return_date, get_patron_borrowed_books, search_books_by_field,
+    get_active_borrow_record, get_patron_loans_and_history,
+    get_patron_total_late_fees, _loan_from_row
 )
 
+# Precompiled ID validators (ASCII digits only)
+_PATRON_RE = re.compile(r'[0-9]{6}').fullmatch
+_ISBN_RE = re.compile(r'[0-9]{13}').fullmatch
+
+# Memoized active-loan due dates for late fees: (patron_id, book_id) -> (fetched_at, due_date)
+LATE_FEE_CACHE_TTL = 60  # seconds
+_late_fee_cache: Dict[Tuple[str, int], Tuple[float, datetime]] = {}
+
+def _invalidate_late_fee(patron_id: str, book_id: int) -> None:
+    """Drop the memoized due date for a patron and book."""
+    _late_fee_cache.pop((patron_id, book_id), None)
+
+def _compute_late_fee(days_overdue: int) -> float:
+    """Late fee for one book: $0.50/day for 7 days, then $1.00/day, capped at $15.00."""
+    if days_overdue <= 0:
+        return 0.00
+    return min(15.00, 0.50 * min(days_overdue, 7) + 1.00 * max(days_overdue - 7, 0))
+
 def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
     """
     Add a new book to the catalog.
@@ -25,24 +47,22 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
     Returns:
         tuple: (success: bool, message: str)
     """
-    # Input validation
-    if not title or not title.strip():
-        return False, "Title is required."
-    
-    if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
-    
-    if not author or not author.strip():
-        return False, "Author is required."
-    
-    if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
-    
-    if len(isbn) != 13 or not isbn.isdigit():
-        return False, "ISBN must be exactly 13 digits."
-    
-    if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+    title = title.strip() if title else ''
+    author = author.strip() if author else ''
+    
+    # Input validation, first failing check wins
+    checks = (
+        (not title, "Title is required."),
+        (len(title) > 200, "Title must be less than 200 characters."),
+        (not author, "Author is required."),
+        (len(author) > 100, "Author must be less than 100 characters."),
+        (not _ISBN_RE(isbn or ''), "ISBN must be exactly 13 digits."),
+        (not isinstance(total_copies, int) or total_copies <= 0,
+         "Total copies must be a positive integer."),
+    )
+    for failed, message in checks:
+        if failed:
+            return False, message
     
     # Check for duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -50,9 +70,9 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
         return False, "A book with this ISBN already exists."
     
     # Insert new book
-    success = insert_book(title.strip(), author.strip(), isbn, total_copies, total_copies)
+    success = insert_book(title, author, isbn, total_copies, total_copies)
     if success:
-        return True, f'Book "{title.strip()}" has been successfully added to the catalog.'
+        return True, f'Book "{title}" has been successfully added to the catalog.'
     else:
         return False, "Database error occurred while adding the book."
 
@@ -69,37 +89,29 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
         tuple: (success: bool, message: str)
     """
     # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not _PATRON_RE(patron_id or ''):
         return False, "Invalid patron ID. Must be exactly 6 digits."
     
-    # Check if book exists and is available
+    # Check if book exists
     book = get_book_by_id(book_id)
     if not book:
         return False, "Book not found."
     
-    if book['available_copies'] <= 0:
-        return False, "This book is currently not available."
-    
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
-    
-    if current_borrowed >= 5:
-        return False, "You have reached the maximum borrowing limit of 5 books."
-    
-    # Create borrow record
     borrow_date = datetime.now()
     due_date = borrow_date + timedelta(days=14)
     
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
+    # Availability check, borrow limit, loan record and stock update in one transaction
+    outcome = try_borrow_book(patron_id, book_id, borrow_date, due_date)
+    if outcome == 'unavailable':
+        return False, "This book is currently not available."
+    if outcome == 'limit_reached':
+        return False, "You have reached the maximum borrowing limit of 5 books."
+    if outcome != 'ok':
         return False, "Database error occurred while creating borrow record."
     
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
+    _invalidate_late_fee(patron_id, book_id)
     
-    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.date().isoformat()}.'
 
 def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
@@ -107,26 +119,21 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     
     TODO: Implement R4 as per requirements
     """
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not _PATRON_RE(patron_id or ''):
         return False, "Invalid patron ID. Must be exactly 6 digits."
     
     book = get_book_by_id(book_id)
     if not book:
         return False, "Book not found."
     
-    borrowed_books = get_patron_borrowed_books(patron_id)
-    
-    borrow_record = None
-    for record in borrowed_books:
-        if record['book_id'] == book_id:
-            borrow_record = record
-            break
+    borrow_record = get_active_borrow_record(patron_id, book_id)
     
     if not borrow_record:
         return False, "No borrowing record found for this patron and book."
     
     return_date = datetime.now()
     success = update_borrow_record_return_date(patron_id, book_id, return_date)
+    _invalidate_late_fee(patron_id, book_id)
     if not success:
         return False, "Database error occurred while updating return date."
     
@@ -134,7 +141,7 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not availability_success:
         return False, "Database error occurred while updating book availability."
     
-    return True, f'Successfully returned "{book["title"]}". Return date: {return_date.strftime("%Y-%m-%d")}.'
+    return True, f'Successfully returned "{book["title"]}". Return date: {return_date.date().isoformat()}.'
 
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     """
@@ -149,48 +156,44 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         'status': 'Late fee calculation not implemented'
     }
     """
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not _PATRON_RE(patron_id or ''):
         return {
             'fee_amount': 0.00,
             'days_overdue': 0,
             'status': 'Invalid patron ID. Must be exactly 6 digits.'
         }
     
-    book = get_book_by_id(book_id)
-    if not book:
-        return {
-            'fee_amount': 0.00,
-            'days_overdue': 0,
-            'status': 'Book not found.'
-        }
-    
-    borrowed_books = get_patron_borrowed_books(patron_id)
-    
-    borrow_record = None
-    for record in borrowed_books:
-        if record['book_id'] == book_id:
-            borrow_record = record
-            break
-    
-    if not borrow_record:
-        return {
-            'fee_amount': 0.00,
-            'days_overdue': 0,
-            'status': 'No active borrowing record found.'
-        }
+    # A memo hit only skips the database lookups; days overdue is always
+    # recomputed from the due date
+    key = (patron_id, book_id)
+    cached = _late_fee_cache.get(key)
+    if cached and time.monotonic() - cached[0] < LATE_FEE_CACHE_TTL:
+        due_date = cached[1]
+    else:
+        book = get_book_by_id(book_id)
+        if not book:
+            return {
+                'fee_amount': 0.00,
+                'days_overdue': 0,
+                'status': 'Book not found.'
+            }
+        
+        borrow_record = get_active_borrow_record(patron_id, book_id)
+        
+        if not borrow_record:
+            return {
+                'fee_amount': 0.00,
+                'days_overdue': 0,
+                'status': 'No active borrowing record found.'
+            }
+        
+        due_date = borrow_record['due_date']
+        _late_fee_cache[key] = (time.monotonic(), due_date)
     
-    due_date = borrow_record['due_date']
     current_date = datetime.now()
     days_overdue = max(0, (current_date - due_date).days)
     
-    fee_amount = 0.00
-    if days_overdue > 0:
-        if days_overdue <= 7:
-            fee_amount = days_overdue * 0.50
-        else:
-            fee_amount = (7 * 0.50) + ((days_overdue - 7) * 1.00)
-        
-        fee_amount = min(fee_amount, 15.00)
+    fee_amount = _compute_late_fee(days_overdue)
     
     return {
         'fee_amount': round(fee_amount, 2),
@@ -198,9 +201,9 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         'status': 'Success' if days_overdue == 0 else f'Overdue by {days_overdue} days'
     }
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+def search_books_in_catalog(search_term: str, search_type: str, limit: int = 100) -> List[Dict]:
     """
-    Search for books in the catalog.
+    Search for books in the catalog, returning at most `limit` results.
     
     TODO: Implement R6 as per requirements
     """
@@ -211,23 +214,21 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
     if search_type not in valid_types:
         return []
     
-    books = get_all_books()
-    results = []
+    search_term = search_term.strip()
     
-    search_term_lower = search_term.strip().lower()
+    # ISBN is a unique exact-match key, so use the indexed lookup
+    # instead of scanning the whole catalog
+    if search_type == 'isbn':
+        book = get_book_by_isbn(search_term)
+        return [book] if book else []
     
-    for book in books:
-        if search_type == 'title':
-            if search_term_lower in book['title'].lower():
-                results.append(book)
-        elif search_type == 'author':
-            if search_term_lower in book['author'].lower():
-                results.append(book)
-        elif search_type == 'isbn':
-            if book['isbn'] == search_term.strip():
-                results.append(book)
+    # A 13-digit term is almost certainly an ISBN, try that first
+    if _ISBN_RE(search_term):
+        book = get_book_by_isbn(search_term)
+        if book:
+            return [book]
     
-    return results
+    return search_books_by_field(search_type, search_term, limit)
 
 def get_patron_status_report(patron_id: str) -> Dict:
     """
@@ -235,7 +236,7 @@ def get_patron_status_report(patron_id: str) -> Dict:
     
     TODO: Implement R7 as per requirements
     """
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not _PATRON_RE(patron_id or ''):
         return {
             'error': 'Invalid patron ID. Must be exactly 6 digits.',
             'currently_borrowed_books': [],
@@ -244,32 +245,15 @@ def get_patron_status_report(patron_id: str) -> Dict:
             'borrowing_history': []
         }
     
-    borrowed_books = get_patron_borrowed_books(patron_id)
-    
-    total_late_fees = 0.00
-    for record in borrowed_books:
-        if record['is_overdue']:
-            days_overdue = (datetime.now() - record['due_date']).days
-            if days_overdue <= 7:
-                late_fee = days_overdue * 0.50
-            else:
-                late_fee = (7 * 0.50) + ((days_overdue - 7) * 1.00)
-            late_fee = min(late_fee, 15.00)
-            total_late_fees += late_fee
-    
-    from database import get_db_connection
-    conn = get_db_connection()
-    history_records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ?
-        ORDER BY br.borrow_date DESC
-    ''', (patron_id,)).fetchall()
-    conn.close()
+    records = get_patron_loans_and_history(patron_id)
+    now = datetime.now()
     
+    # Split the single result set into active loans and full history
+    borrowed_books = []
     borrowing_history = []
-    for record in history_records:
+    for record in records:
+        if record['active']:
+            borrowed_books.append(_loan_from_row(record, now))
         borrowing_history.append({
             'book_id': record['book_id'],
             'title': record['title'],
@@ -278,6 +262,10 @@ def get_patron_status_report(patron_id: str) -> Dict:
             'due_date': record['due_date'],
             'return_date': record['return_date']
         })
+    # Active loans are listed oldest first
+    borrowed_books.reverse()
+    
+    total_late_fees = get_patron_total_late_fees(patron_id, now)
     
     return {
         'currently_borrowed_books': borrowed_books,
@@ -289,7 +277,7 @@ def get_patron_status_report(patron_id: str) -> Dict:
 from services.payment_service import PaymentGateway
 
 def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway):
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not _PATRON_RE(patron_id or ''):
         return False, "Invalid patron ID"
     book = get_book_by_id(book_id)
     if not book:
@@ -307,8 +295,30 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway)
         return False, f"Payment exception: {e}"
     if not resp or resp.get("status") != "success":
         return False, (resp.get("reason") if isinstance(resp, dict) else "Payment failed")
+    _invalidate_late_fee(patron_id, book_id)
     return True, {"transaction_id": resp["transaction_id"], "charged": round(fee, 2), "days_overdue": days}
 
+def pay_all_late_fees(patron_id: str, payment_gateway: PaymentGateway):
+    if not _PATRON_RE(patron_id or ''):
+        return False, "Invalid patron ID"
+    now = datetime.now()
+    breakdown = {}
+    # A patron can hold several copies of the same book, so fees are summed per book
+    for r in get_patron_borrowed_books(patron_id):
+        fee = _compute_late_fee((now - r["due_date"]).days)
+        if fee > 0:
+            breakdown[r["book_id"]] = round(breakdown.get(r["book_id"], 0) + fee, 2)
+    total = round(sum(breakdown.values()), 2)
+    if total <= 0:
+        return True, "No late fees"
+    try:
+        resp = payment_gateway.process_payment(patron_id, total)
+    except Exception as e:
+        return False, f"Payment exception: {e}"
+    if not resp or resp.get("status") != "success":
+        return False, (resp.get("reason") if isinstance(resp, dict) else "Payment failed")
+    return True, {"transaction_id": resp["transaction_id"], "charged": total, "fees_by_book": breakdown}
+
 def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway):
     if not transaction_id or not isinstance(transaction_id, str):
         return False, "Invalid transaction"
@@ -0,0 +1,13 @@
+import pytest
+
+import database
+import services.library_service as library_service
+
+
+@pytest.fixture
+def isolated_db(tmp_path, monkeypatch):
+    # fresh sample database in tmp_path, with the late-fee memo emptied
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "library.db"))
+    monkeypatch.setattr(library_service, "_late_fee_cache", {})
+    database.init_database()
+    database.add_sample_data()
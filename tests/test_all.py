@@ -67,6 +67,19 @@ def test_catalog_books_ordered():
         titles = [book["title"] for book in books]
         assert titles == sorted(titles)
 
+def test_db_connection_shared_within_app_context(isolated_db):
+    # one connection per app context, closed on teardown
+    from app import create_app
+    from database import get_db_connection
+    app = create_app()
+    with app.app_context():
+        conn = get_db_connection()
+        assert get_db_connection() is conn
+        assert len(get_all_books()) > 0
+    other = get_db_connection()
+    assert other is not conn
+    other.close()
+
 import pytest 
 
 from services.library_service import borrow_book_by_patron
@@ -88,6 +101,31 @@ def test_borrow_patron_id_has_letters():
     assert success == False
     assert "6 digits" in msg
 
+def test_borrow_patron_id_trailing_newline():
+    # trailing newline is not a valid 6 digit id
+    success, msg = borrow_book_by_patron("123456\n", 1)
+    assert success == False
+    assert "6 digits" in msg
+
+def test_borrow_unavailable_book(isolated_db):
+    # 1984 has its only copy out in the sample data -> should fail
+    success, msg = borrow_book_by_patron("181818", 3)
+    assert success == False
+    assert "not available" in msg.lower()
+
+def test_borrow_limit_of_five(isolated_db):
+    # sixth active loan is rejected without touching stock
+    from database import insert_borrow_record, get_book_by_id
+    from datetime import datetime, timedelta
+    now = datetime.now()
+    for _ in range(5):
+        insert_borrow_record("191919", 3, now, now + timedelta(days=14))
+    copies = get_book_by_id(1)["available_copies"]
+    success, msg = borrow_book_by_patron("191919", 1)
+    assert success == False
+    assert "limit" in msg.lower()
+    assert get_book_by_id(1)["available_copies"] == copies
+
 def test_borrow_nonexistent_book():
     # book id 0 doesn't exist -> should fail
     success, msg = borrow_book_by_patron("123456", 0)
@@ -116,6 +154,13 @@ def test_return_already_returned():
     success, msg = return_book_by_patron("666666", 1)
     assert success == False
 
+def test_return_after_borrow(isolated_db):
+    # borrow then return the same book -> should succeed
+    borrow_book_by_patron("121212", 1)
+    success, msg = return_book_by_patron("121212", 1)
+    assert success == True
+    assert "returned" in msg.lower()
+
 def test_return_negative_book_id():
     # negative book id -> should fail
     success, msg = return_book_by_patron("123456", -1)
@@ -170,6 +215,47 @@ def test_late_fee_book_id_string():
     assert 'days_overdue' in result
     assert 'status' in result
 
+def test_late_fee_cleared_after_return(isolated_db):
+    # memoized fee must not survive the book being returned
+    from services.library_service import borrow_book_by_patron, return_book_by_patron
+    borrow_book_by_patron("161616", 2)
+    assert calculate_late_fee_for_book("161616", 2)["status"] == "Success"
+    return_book_by_patron("161616", 2)
+    result = calculate_late_fee_for_book("161616", 2)
+    assert result["status"] == "No active borrowing record found."
+
+def test_late_fee_uses_oldest_active_copy(isolated_db):
+    # two active copies of one book -> fee comes from the earliest loan
+    from datetime import datetime, timedelta
+    from database import insert_borrow_record
+    now = datetime.now()
+    due_new = now + timedelta(days=5)
+    insert_borrow_record("202020", 1, now, due_new)
+    due_old = now - timedelta(days=3, hours=1)
+    insert_borrow_record("202020", 1, due_old - timedelta(days=14), due_old)
+    result = calculate_late_fee_for_book("202020", 1)
+    assert result["days_overdue"] == 3
+
+def test_late_fee_memo_recomputes_days(isolated_db, mocker):
+    # a memo hit must not freeze days overdue at the earlier value
+    from datetime import datetime, timedelta
+    from database import insert_borrow_record
+    now = datetime.now()
+    due = now - timedelta(days=2, hours=1)
+    insert_borrow_record("212121", 1, due - timedelta(days=14), due)
+    assert calculate_late_fee_for_book("212121", 1)["days_overdue"] == 2
+    later = mocker.patch("services.library_service.datetime")
+    later.now.return_value = now + timedelta(days=1)
+    assert calculate_late_fee_for_book("212121", 1)["days_overdue"] == 3
+
+def test_late_fee_formula_tiers():
+    # first week at 0.50/day, then 1.00/day, capped at 15.00
+    from services.library_service import _compute_late_fee
+    assert _compute_late_fee(0) == 0.0
+    assert _compute_late_fee(7) == 3.5
+    assert _compute_late_fee(10) == 6.5
+    assert _compute_late_fee(40) == 15.0
+
 import pytest 
 
 from services.library_service import search_books_in_catalog
@@ -199,6 +285,42 @@ def test_search_invalid_type():
     results = search_books_in_catalog("test", "invalid")
     assert isinstance(results, list)
 
+def test_search_isbn_sees_availability_change(isolated_db):
+    # isbn index must reflect a borrow made after it was built
+    from services.library_service import borrow_book_by_patron, return_book_by_patron
+    before = search_books_in_catalog("9780061120084", "isbn")[0]["available_copies"]
+    borrow_book_by_patron("171717", 2)
+    after = search_books_in_catalog("9780061120084", "isbn")[0]["available_copies"]
+    return_book_by_patron("171717", 2)
+    assert after == before - 1
+
+def test_search_title_case_insensitive():
+    # partial lowercase title -> should match mockingbird
+    results = search_books_in_catalog("mockingbird", "title")
+    assert any(book["title"] == "To Kill a Mockingbird" for book in results)
+
+def test_search_respects_limit():
+    # "e" matches several sample titles -> capped at the limit
+    results = search_books_in_catalog("e", "title", limit=1)
+    assert len(results) == 1
+
+def test_search_wildcard_is_literal():
+    # "%" should not act as a sql wildcard
+    results = search_books_in_catalog("%", "author")
+    assert results == []
+
+def test_search_non_ascii_case_insensitive(isolated_db):
+    # lowercase accented term -> should match the capitalised author
+    add_book_to_catalog("Germinal", "Émile Zola", "9780140447422", 1)
+    results = search_books_in_catalog("émile", "author")
+    assert [book["title"] for book in results] == ["Germinal"]
+
+def test_search_gatsby_isbn_exact():
+    # isbn search is an exact match -> only the gatsby book
+    results = search_books_in_catalog(" 9780743273565 ", "isbn")
+    assert len(results) == 1
+    assert results[0]["title"] == "The Great Gatsby"
+
 import pytest 
 
 from services.library_service import get_patron_status_report
@@ -223,6 +345,33 @@ def test_patron_status_borrowing_history():
     status = get_patron_status_report("333333")
     assert isinstance(status, dict)
 
+def test_patron_status_sees_new_borrow(isolated_db):
+    # a new borrow shows up in the report straight away
+    before = get_patron_status_report("131313")
+    borrow_book_by_patron("131313", 2)
+    after = get_patron_status_report("131313")
+    assert after["total_borrowed"] == before["total_borrowed"] + 1
+
+def test_patron_status_history_includes_returned(isolated_db):
+    # returned books stay in history but leave the current list
+    borrow_book_by_patron("141414", 2)
+    return_book_by_patron("141414", 2)
+    status = get_patron_status_report("141414")
+    assert status["total_borrowed"] == 0
+    assert len(status["borrowing_history"]) == 1
+    assert status["borrowing_history"][0]["return_date"] is not None
+
+def test_patron_total_late_fees_tiers(isolated_db):
+    # 3, 10 and 40 days overdue -> 1.50 + 6.50 + 15.00 (capped)
+    from datetime import datetime, timedelta
+    from database import insert_borrow_record, get_patron_total_late_fees
+    now = datetime.now()
+    for days in (3, 10, 40):
+        due = now - timedelta(days=days, hours=1)
+        insert_borrow_record("151515", 1, due - timedelta(days=14), due)
+    assert get_patron_total_late_fees("151515", now) == 23.0
+    assert get_patron_status_report("151515")["total_late_fees"] == 23.0
+
 def test_patron_status_total_borrowed():
     # check if status includes total borrowed count
     status = get_patron_status_report("444444")
@@ -6,12 +6,17 @@ import time
 import sys
 
 import pytest
+
+pytest.importorskip("playwright")
 from playwright.sync_api import sync_playwright, Page, expect
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app import create_app
 
 
+# Full browser runs are slow; skipped by default, run with `pytest -m slow`
+pytestmark = pytest.mark.slow
+
 BASE_URL = os.getenv("APP_BASE_URL", "http://127.0.0.1:5000")
 ADD_BOOK_URL = f"{BASE_URL}/add_book"
 CATALOG_URL = f"{BASE_URL}/catalog"
@@ -0,0 +1,74 @@
+import os
+import re
+import sys
+import uuid
+
+import pytest
+from markupsafe import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import create_app
+from database import get_book_by_id
+
+
+@pytest.fixture
+def client(isolated_db):
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+def make_unique_book_data():
+    suffix = uuid.uuid4().hex[:6]
+    isbn_suffix_int = uuid.uuid4().int % 10**10
+    isbn_13_digits = "978" + f"{isbn_suffix_int:010d}"
+
+    return {
+        "title": f"Test Book {suffix}",
+        "author": f"Test Author {suffix}",
+        "isbn": isbn_13_digits,
+        "total_copies": "3",
+    }
+
+
+def make_unique_patron_id():
+    return f"{uuid.uuid4().int % 10**6:06d}"
+
+
+def add_book_through_form(client, book: dict):
+    response = client.post("/add_book", data=book)
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/catalog")
+
+
+def find_book_id_in_catalog(client, book: dict) -> str:
+    page = client.get("/catalog").get_data(as_text=True)
+    match = re.search(r"<td>(\d+)</td>\s*<td>" + re.escape(book["title"]) + "</td>", page)
+    assert match, f'{book["title"]} not found in catalog'
+    return match.group(1)
+
+
+@pytest.mark.e2e
+def test_add_new_book_appears_in_catalog(client):
+    book = make_unique_book_data()
+    add_book_through_form(client, book)
+    assert book["title"].encode() in client.get("/catalog").data
+
+
+@pytest.mark.e2e
+def test_borrow_book_flow_shows_confirmation_message(client):
+    book = make_unique_book_data()
+    patron_id = make_unique_patron_id()
+
+    add_book_through_form(client, book)
+    book_id = find_book_id_in_catalog(client, book)
+    copies_before = get_book_by_id(int(book_id))["available_copies"]
+
+    response = client.post(
+        "/borrow", data={"patron_id": patron_id, "book_id": book_id}, follow_redirects=True
+    )
+    assert response.status_code == 200
+    confirmation = str(escape(f'Successfully borrowed "{book["title"]}"'))
+    assert confirmation in response.get_data(as_text=True)
+    assert get_book_by_id(int(book_id))["available_copies"] == copies_before - 1
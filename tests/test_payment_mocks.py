@@ -1,5 +1,6 @@
 from unittest.mock import Mock
-from services.library_service import pay_late_fees, refund_late_fee_payment
+from datetime import datetime, timedelta
+from services.library_service import pay_late_fees, pay_all_late_fees, refund_late_fee_payment
 from services.payment_service import PaymentGateway
 
 FAKE_BOOK = {"id": 1, "title": "T", "author": "A", "isbn": "1234567890123", "available_copies": 1}
@@ -39,6 +40,37 @@ def test_pay_invalid_patron_skips_gateway(mocker):
     assert not ok
     pg.process_payment.assert_not_called()
 
+def setup_loans(mocker, *days_overdue):
+    now = datetime.now()
+    loans = [{"book_id": i + 1, "due_date": now - timedelta(days=d, hours=1)} for i, d in enumerate(days_overdue)]
+    mocker.patch("services.library_service.get_patron_borrowed_books", return_value=loans)
+
+def test_pay_all_single_gateway_call(mocker):
+    setup_loans(mocker, 3, 10, -2)
+    pg = Mock(spec=PaymentGateway)
+    pg.process_payment.return_value = {"status": "success", "transaction_id": "TXN123456800"}
+    ok, p = pay_all_late_fees("123456", pg)
+    assert ok and p["charged"] == 8.0 and p["fees_by_book"] == {1: 1.5, 2: 6.5}
+    pg.process_payment.assert_called_once_with("123456", 8.0)
+
+def test_pay_all_sums_copies_of_same_book(mocker):
+    now = datetime.now()
+    loans = [{"book_id": 3, "due_date": now - timedelta(days=d, hours=1)} for d in (3, 10)]
+    fetch = mocker.patch("services.library_service.get_patron_borrowed_books", return_value=loans)
+    pg = Mock(spec=PaymentGateway)
+    pg.process_payment.return_value = {"status": "success", "transaction_id": "TXN123456800"}
+    ok, p = pay_all_late_fees("123456", pg)
+    assert ok and p["charged"] == 8.0 and p["fees_by_book"] == {3: 8.0}
+    pg.process_payment.assert_called_once_with("123456", 8.0)
+    fetch.assert_called_once_with("123456")
+
+def test_pay_all_nothing_overdue(mocker):
+    setup_loans(mocker, -5)
+    pg = Mock(spec=PaymentGateway)
+    ok, msg = pay_all_late_fees("123456", pg)
+    assert ok and msg == "No late fees"
+    pg.process_payment.assert_not_called()
+
 def test_refund_success():
     pg = Mock(spec=PaymentGateway)
     pg.refund_payment.return_value = {"status": "refunded", "refund_id": "RFtx", "amount": 3.0}